@@ -0,0 +1,117 @@
+from fastapi import APIRouter, File, UploadFile, Form, HTTPException
+from fastapi.responses import JSONResponse, StreamingResponse
+import logging
+import asyncio
+import json
+
+from app.services.job_worker import job_queue, job_workers
+
+# 配置日志
+logger = logging.getLogger("job_routes")
+logger.setLevel(logging.INFO)
+
+router = APIRouter()
+
+@router.post("/jobs")
+async def submit_job(
+    message: str = Form(...),
+    screenshot: UploadFile = File(None),
+    session_id: str = Form(None),
+    priority: int = Form(0, ge=0, le=100, description="优先级，数值越大越先处理"),
+    ttl: int = Form(3600, ge=60, le=7 * 24 * 3600, description="结果保留时间（秒）")
+):
+    """
+    提交异步问答任务，立即返回任务ID（相同任务复用时按较高的优先级排队）
+    """
+    if not message:
+        raise HTTPException(status_code=400, detail="消息内容不能为空")
+
+    image = None
+    content_type = None
+    if screenshot and getattr(screenshot, 'filename', None):
+        if not screenshot.content_type.startswith("image/"):
+            raise HTTPException(status_code=400, detail="文件必须是图片格式")
+        image = await screenshot.read()
+        content_type = screenshot.content_type
+
+    job, deduplicated = await asyncio.to_thread(
+        job_queue.submit, message, image, content_type, session_id, priority, ttl
+    )
+    if not deduplicated:
+        job_workers.notify()
+    logger.info(f"📥 任务已提交: {job['id']} (去重: {deduplicated})")
+
+    return JSONResponse({
+        "job_id": job["id"],
+        "status": job["status"],
+        "deduplicated": deduplicated
+    }, status_code=202)
+
+@router.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """
+    查询任务状态和结果
+    """
+    job = await asyncio.to_thread(job_queue.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在或已过期")
+
+    if job["status"] == "running":
+        job["partial"] = job_workers.progress.get(job_id, {}).get("text", "")
+    return JSONResponse(job)
+
+@router.get("/jobs/{job_id}/events")
+async def stream_job_events(job_id: str):
+    """
+    通过SSE订阅任务进度，直到任务完成
+    """
+    job = await asyncio.to_thread(job_queue.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在或已过期")
+
+    return StreamingResponse(job_event_stream(job_id), media_type="text/event-stream")
+
+async def job_event_stream(job_id: str, interval: float = 0.5):
+    """
+    生成任务进度事件流
+    """
+    sent = 0
+    streamed_attempt = None
+    last_status = None
+    while True:
+        job = await asyncio.to_thread(job_queue.get, job_id)
+        if job is None:
+            yield "data: " + json.dumps({"error": "任务不存在或已过期"}) + "\n\n"
+            return
+
+        if job["status"] != last_status:
+            last_status = job["status"]
+            yield "data: " + json.dumps({"type": "status", "status": last_status}) + "\n\n"
+
+        if job["status"] == "running":
+            progress = job_workers.progress.get(job_id)
+            if progress:
+                # 重试时从头开始生成，通知客户端丢弃已收到的内容
+                if progress["attempt"] != streamed_attempt:
+                    if sent:
+                        yield "data: " + json.dumps({"type": "reset"}) + "\n\n"
+                    streamed_attempt = progress["attempt"]
+                    sent = 0
+                partial = progress["text"]
+                if len(partial) > sent:
+                    yield "data: " + json.dumps({"type": "content", "content": partial[sent:]}) + "\n\n"
+                    sent = len(partial)
+        elif job["status"] == "done":
+            result = job["result"] or ""
+            if sent and streamed_attempt != job["attempts"]:
+                yield "data: " + json.dumps({"type": "reset"}) + "\n\n"
+                sent = 0
+            if len(result) > sent:
+                yield "data: " + json.dumps({"type": "content", "content": result[sent:]}) + "\n\n"
+            yield "data: " + json.dumps({"type": "done", "message": "响应完成"}) + "\n\n"
+            return
+        elif job["status"] == "failed":
+            yield "data: " + json.dumps({"error": job["error"]}) + "\n\n"
+            return
+
+        await asyncio.sleep(interval)
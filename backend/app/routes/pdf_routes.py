@@ -3,11 +3,14 @@ from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
 from typing import Optional, List
 import httpx
-import base64
 from datetime import datetime
 import logging
 import asyncio
 import json
+import time
+
+from app.services.image_cache import image_cache
+from app.services.usage_ledger import usage_ledger
 
 # 配置日志
 logger = logging.getLogger("pdf_routes")
@@ -35,18 +38,66 @@ async def health_check():
     """
     return {"status": "ok", "message": "PDF API服务正常运行"}
 
+@router.post("/images")
+async def preupload_screenshot(screenshot: UploadFile = File(...)):
+    """
+    预上传截图，选区完成后立即调用，返回供聊天接口引用的图片句柄
+    """
+    if not screenshot.content_type.startswith("image/"):
+        raise HTTPException(status_code=400, detail="文件必须是图片格式")
+
+    content = await screenshot.read()
+    try:
+        image = await asyncio.to_thread(image_cache.put, content)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return JSONResponse({
+        "image_handle": image["handle"],
+        "size": image["size"],
+        "width": image["width"],
+        "height": image["height"],
+        "expires_at": datetime.fromtimestamp(image["expires_at"]).isoformat(),
+        "status": "success"
+    })
+
+async def load_screenshot(screenshot: UploadFile = None, image_handle: str = None) -> Optional[dict]:
+    """
+    获取消息附带的截图，优先使用预上传的图片句柄
+    """
+    if image_handle:
+        image = image_cache.get(image_handle)
+        if image is None:
+            raise HTTPException(status_code=404, detail="截图已过期，请重新截图")
+        return image
+
+    if screenshot and getattr(screenshot, 'filename', None):
+        if not screenshot.content_type.startswith("image/"):
+            logger.error(f"❌ 文件类型错误: {screenshot.content_type}")
+            raise HTTPException(status_code=400, detail="文件必须是图片格式")
+        content = await screenshot.read()
+        try:
+            return await asyncio.to_thread(image_cache.put, content)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    return None
+
 @router.post("/chat")
 async def send_chat_message(
     message: str = Form(...),
     timestamp: str = Form(None),
-    screenshot: UploadFile = File(None)
+    screenshot: UploadFile = File(None),
+    session_id: str = Form(None),
+    image_handle: str = Form(None)
 ):
     """
-    处理聊天消息，支持文本和可选的截图
+    处理聊天消息，支持文本和可选的截图（文件或预上传的图片句柄）
     """
-    return await process_chat_message(message, timestamp, screenshot)
+    return await process_chat_message(message, timestamp, screenshot, session_id, image_handle)
 
-async def process_chat_message(message: str, timestamp: str = None, screenshot: UploadFile = None):
+async def process_chat_message(message: str, timestamp: str = None, screenshot: UploadFile = None,
+                               session_id: str = None, image_handle: str = None):
     """
     统一处理聊天消息的核心逻辑
     """
@@ -55,11 +106,14 @@ async def process_chat_message(message: str, timestamp: str = None, screenshot:
         logger.info(f"📝 消息内容: {message}")
         logger.info(f"⏰ 时间戳: {timestamp}")
         logger.info(f"📸 截图文件: {screenshot.filename if screenshot and screenshot.filename else 'None'}")
+        logger.info(f"🔖 图片句柄: {image_handle}")
 
         if not message:
             logger.warning("❌ 消息内容为空")
             raise HTTPException(status_code=400, detail="消息内容不能为空")
 
+        image = await load_screenshot(screenshot, image_handle)
+
         current_time = timestamp or datetime.now().isoformat()
 
         # 保存用户消息到历史
@@ -68,28 +122,21 @@ async def process_chat_message(message: str, timestamp: str = None, screenshot:
             "type": "user",
             "content": message,
             "timestamp": current_time,
-            "hasScreenshot": screenshot is not None and getattr(screenshot, 'filename', None) is not None
+            "hasScreenshot": image is not None
         }
         chat_history.append(user_message)
         logger.info(f"💾 用户消息已保存到历史，ID: {user_message['id']}")
 
         # 生成AI回复
-        if screenshot and getattr(screenshot, 'filename', None):
+        if image:
             logger.info("🖼️  检测到截图，准备调用视觉模型")
             # 有截图的情况，调用视觉模型
             try:
-                # 验证文件类型
-                if not screenshot.content_type.startswith("image/"):
-                    logger.error(f"❌ 文件类型错误: {screenshot.content_type}")
-                    raise HTTPException(status_code=400, detail="文件必须是图片格式")
-
-                # 读取图片内容并转为base64
-                image_content = await screenshot.read()
-                image_size = len(image_content)
-                logger.info(f"📷 图片读取成功，大小: {image_size} bytes")
-
-                image_base64 = base64.b64encode(image_content).decode('utf-8')
-                logger.info(f"🔧 Base64编码完成，长度: {len(image_base64)}")
+                # 截图已在上传时完成预处理和base64编码
+                image_size = image["size"]
+                # 实际发送给上游的字节数（base64编码后的data URL）
+                sent_bytes = len(image["data_url"])
+                logger.info(f"📷 使用缓存截图 {image['handle'][:12]}，大小: {image_size} bytes")
 
                 # 调用外部视觉API（与ask接口保持一致）
                 api_url = "https://qfgapi.com/v1/chat/completions"
@@ -111,7 +158,7 @@ async def process_chat_message(message: str, timestamp: str = None, screenshot:
                                 {
                                     "type": "image_url",
                                     "image_url": {
-                                        "url": f"data:image/{screenshot.content_type.split('/')[-1]};base64,{image_base64}"
+                                        "url": image["data_url"]
                                     }
                                 }
                             ]
@@ -132,14 +179,19 @@ async def process_chat_message(message: str, timestamp: str = None, screenshot:
                         logger.info(f"🔄 第 {attempt + 1} 次尝试 (共 {max_retries + 1} 次)")
                         await asyncio.sleep(retry_delay)
 
+                    started_at = time.perf_counter()
+                    status_code = None
+                    usage = None
                     try:
                         async with httpx.AsyncClient() as client:
                             response = await client.post(api_url, json=payload, headers=headers, timeout=30.0)
+                        status_code = response.status_code
 
                         logger.info(f"📡 API响应状态码: {response.status_code} (尝试 {attempt + 1})")
 
                         if response.status_code == 200:
                             result = response.json()
+                            usage = result.get("usage")
                             logger.info(f"✅ API调用成功，响应: {result}")
                             reply = result.get("choices", [{}])[0].get("message", {}).get("content", "抱歉，无法分析这张图片")
                             break
@@ -168,6 +220,10 @@ async def process_chat_message(message: str, timestamp: str = None, screenshot:
                     except Exception as e:
                         logger.error(f"❌ 网络异常 (尝试 {attempt + 1}): {str(e)}")
                         last_error = f"网络异常: {str(e)}"
+                    finally:
+                        # 记录本次上游调用的用量
+                        usage_ledger.record(payload["model"], "chat", status_code, started_at,
+                                            usage=usage, image_bytes=sent_bytes, session_id=session_id)
 
                     # 如果是最后一次尝试，设置失败回复
                     if attempt == max_retries:
@@ -206,6 +262,8 @@ async def process_chat_message(message: str, timestamp: str = None, screenshot:
         logger.info(f"✅ 聊天消息处理完成")
         return JSONResponse(response_data)
 
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"❌ 聊天接口错误: {str(e)}")
         logger.error(f"❌ 错误类型: {type(e).__name__}")
@@ -235,17 +293,25 @@ async def get_chat_history(limit: int = 50):
 async def stream_chat_message(
     message: str = Form(...),
     timestamp: str = Form(None),
-    screenshot: UploadFile = File(None)
+    screenshot: UploadFile = File(None),
+    session_id: str = Form(None),
+    image_handle: str = Form(None)
 ):
     """
     流式处理聊天消息，实时返回AI回复
     """
+    logger.info(f"📸 截图文件: {screenshot.filename if screenshot and screenshot.filename else 'None'}")
+    logger.info(f"🔖 图片句柄: {image_handle}")
+
+    # 在开始流式响应前获取截图，句柄过期时直接返回404，便于前端改为上传截图重试
+    image = await load_screenshot(screenshot, image_handle)
+
     return StreamingResponse(
-        stream_chat_response(message, timestamp, screenshot),
+        stream_chat_response(message, timestamp, image, session_id),
         media_type="text/plain"
     )
 
-async def stream_chat_response(message: str, timestamp: str = None, screenshot: UploadFile = None):
+async def stream_chat_response(message: str, timestamp: str = None, image: dict = None, session_id: str = None):
     """
     生成流式聊天响应
     """
@@ -253,7 +319,6 @@ async def stream_chat_response(message: str, timestamp: str = None, screenshot:
         logger.info(f"🎯 开始流式处理聊天消息")
         logger.info(f"📝 消息内容: {message}")
         logger.info(f"⏰ 时间戳: {timestamp}")
-        logger.info(f"📸 截图文件: {screenshot.filename if screenshot and screenshot.filename else 'None'}")
 
         if not message:
             yield "data: " + json.dumps({"error": "消息内容不能为空"}) + "\n\n"
@@ -267,7 +332,7 @@ async def stream_chat_response(message: str, timestamp: str = None, screenshot:
             "type": "user",
             "content": message,
             "timestamp": current_time,
-            "hasScreenshot": screenshot is not None and getattr(screenshot, 'filename', None) is not None
+            "hasScreenshot": image is not None
         }
         chat_history.append(user_message)
         logger.info(f"💾 用户消息已保存到历史，ID: {user_message['id']}")
@@ -276,37 +341,30 @@ async def stream_chat_response(message: str, timestamp: str = None, screenshot:
         yield "data: " + json.dumps({"type": "user_saved", "message": "消息已接收，AI正在思考..."}) + "\n\n"
 
         # 生成AI回复
-        if screenshot and getattr(screenshot, 'filename', None):
+        if image:
             logger.info("🖼️  检测到截图，准备调用视觉模型")
-            async for chunk in stream_vision_response(message, screenshot):
+            async for chunk in stream_vision_response(message, image, session_id):
                 yield chunk
         else:
             logger.info("💬 处理纯文本聊天")
-            async for chunk in stream_text_response(message):
+            async for chunk in stream_text_response(message, session_id):
                 yield chunk
 
     except Exception as e:
         logger.error(f"❌ 流式聊天接口错误: {str(e)}")
         yield "data: " + json.dumps({"error": f"处理聊天消息时发生错误: {str(e)}"}) + "\n\n"
 
-async def stream_vision_response(message: str, screenshot: UploadFile):
+async def stream_vision_response(message: str, image: dict, session_id: str = None):
     """
     流式处理带图片的聊天
     """
     full_response = ""  # 初始化完整响应
     try:
-        # 验证文件类型
-        if not screenshot.content_type.startswith("image/"):
-            yield "data: " + json.dumps({"error": "文件必须是图片格式"}) + "\n\n"
-            return
-
-        # 读取图片内容并转为base64
-        image_content = await screenshot.read()
-        image_size = len(image_content)
-        logger.info(f"📷 图片读取成功，大小: {image_size} bytes")
-
-        image_base64 = base64.b64encode(image_content).decode('utf-8')
-        logger.info(f"🔧 Base64编码完成，长度: {len(image_base64)}")
+        # 截图已在上传时完成预处理和base64编码
+        image_size = image["size"]
+        # 实际发送给上游的字节数（base64编码后的data URL）
+        sent_bytes = len(image["data_url"])
+        logger.info(f"📷 使用缓存截图 {image['handle'][:12]}，大小: {image_size} bytes")
 
         yield "data: " + json.dumps({"type": "processing", "message": "小魁正在思考中..."}) + "\n\n"
 
@@ -320,6 +378,7 @@ async def stream_vision_response(message: str, screenshot: UploadFile):
         payload = {
             "model": "gemini-2.5-pro-thinking",  # 使用原来的模型
             "stream": True,  # 启用流式响应
+            "stream_options": {"include_usage": True},  # 在最后一个chunk中返回用量
             "messages": [
                 {
                     "role": "user",
@@ -331,7 +390,7 @@ async def stream_vision_response(message: str, screenshot: UploadFile):
                         {
                             "type": "image_url",
                             "image_url": {
-                                "url": f"data:image/{screenshot.content_type.split('/')[-1]};base64,{image_base64}"
+                                "url": image["data_url"]
                             }
                         }
                     ]
@@ -345,9 +404,14 @@ async def stream_vision_response(message: str, screenshot: UploadFile):
         full_response = ""
         api_success = False
 
+        started_at = time.perf_counter()
+        first_token_at = None
+        status_code = None
+        usage = None
         try:
             async with httpx.AsyncClient() as client:
                 async with client.stream('POST', api_url, json=payload, headers=headers, timeout=60.0) as response:
+                    status_code = response.status_code
                     if response.status_code == 200:
                         logger.info("✅ 开始接收视觉流式响应")
                         api_success = True
@@ -362,10 +426,14 @@ async def stream_vision_response(message: str, screenshot: UploadFile):
                                 try:
                                     chunk_json = json.loads(chunk_data)
                                     logger.info(f"📊 视觉API解析的JSON: {chunk_json}")
+                                    if chunk_json.get('usage'):
+                                        usage = chunk_json['usage']
                                     if 'choices' in chunk_json and len(chunk_json['choices']) > 0:
                                         delta = chunk_json['choices'][0].get('delta', {})
                                         if 'content' in delta:
                                             content = delta['content']
+                                            if first_token_at is None:
+                                                first_token_at = time.perf_counter()
                                             full_response += content
                                             logger.info(f"📝 视觉API发送内容块: {repr(content)}")
                                             yield "data: " + json.dumps({"type": "content", "content": content}) + "\n\n"
@@ -395,6 +463,10 @@ async def stream_vision_response(message: str, screenshot: UploadFile):
                         logger.error(f"❌ {error_msg}")
         except Exception as e:
             logger.error(f"❌ API调用异常: {str(e)}")
+        finally:
+            # 记录本次上游调用的用量
+            usage_ledger.record(payload["model"], "chat/stream", status_code, started_at, first_token_at,
+                                usage=usage, image_bytes=sent_bytes, session_id=session_id)
 
         # 如果API调用失败，直接输出真实API错误信息
         if not api_success or not full_response.strip():
@@ -402,9 +474,12 @@ async def stream_vision_response(message: str, screenshot: UploadFile):
 
             # 尝试获取详细的API错误信息
             error_message = "未知错误"
+            probe_started_at = time.perf_counter()
             try:
                 async with httpx.AsyncClient() as client:
                     response = await client.post(api_url, json=payload, headers=headers, timeout=10.0)
+                    usage_ledger.record(payload["model"], "chat/stream/probe", response.status_code, probe_started_at,
+                                        image_bytes=sent_bytes, session_id=session_id)
                     if response.status_code != 200:
                         error_response = await response.atext()
                         try:
@@ -453,7 +528,7 @@ async def stream_vision_response(message: str, screenshot: UploadFile):
 
         yield "data: " + json.dumps({"error": error_response}) + "\n\n"
 
-async def stream_text_response(message: str):
+async def stream_text_response(message: str, session_id: str = None):
     """
     流式处理纯文本聊天
     """
@@ -470,6 +545,7 @@ async def stream_text_response(message: str):
         payload = {
             "model": "gemini-2.5-pro-thinking",  # 使用原来的模型
             "stream": True,  # 启用流式响应
+            "stream_options": {"include_usage": True},  # 在最后一个chunk中返回用量
             "messages": [
                 {
                     "role": "user",
@@ -485,9 +561,14 @@ async def stream_text_response(message: str):
         full_response = ""
         api_success = False
 
+        started_at = time.perf_counter()
+        first_token_at = None
+        status_code = None
+        usage = None
         try:
             async with httpx.AsyncClient() as client:
                 async with client.stream('POST', api_url, json=payload, headers=headers, timeout=60.0) as response:
+                    status_code = response.status_code
                     if response.status_code == 200:
                         logger.info("✅ 开始接收文本流式响应")
                         api_success = True
@@ -502,10 +583,14 @@ async def stream_text_response(message: str):
                                 try:
                                     chunk_json = json.loads(chunk_data)
                                     logger.info(f"📊 文本API解析的JSON: {chunk_json}")
+                                    if chunk_json.get('usage'):
+                                        usage = chunk_json['usage']
                                     if 'choices' in chunk_json and len(chunk_json['choices']) > 0:
                                         delta = chunk_json['choices'][0].get('delta', {})
                                         if 'content' in delta:
                                             content = delta['content']
+                                            if first_token_at is None:
+                                                first_token_at = time.perf_counter()
                                             full_response += content
                                             logger.info(f"📝 文本API发送内容块: {repr(content)}")
                                             yield "data: " + json.dumps({"type": "content", "content": content}) + "\n\n"
@@ -535,6 +620,10 @@ async def stream_text_response(message: str):
                         logger.error(f"❌ {error_msg}")
         except Exception as e:
             logger.error(f"❌ API调用异常: {str(e)}")
+        finally:
+            # 记录本次上游调用的用量
+            usage_ledger.record(payload["model"], "chat/stream", status_code, started_at, first_token_at,
+                                usage=usage, image_bytes=0, session_id=session_id)
 
         # 如果API调用失败，直接输出真实API错误信息
         if not api_success or not full_response.strip():
@@ -542,9 +631,12 @@ async def stream_text_response(message: str):
 
             # 尝试获取详细的API错误信息
             error_message = "未知错误"
+            probe_started_at = time.perf_counter()
             try:
                 async with httpx.AsyncClient() as client:
                     response = await client.post(api_url, json=payload, headers=headers, timeout=10.0)
+                    usage_ledger.record(payload["model"], "chat/stream/probe", response.status_code, probe_started_at,
+                                        image_bytes=0, session_id=session_id)
                     if response.status_code != 200:
                         error_response = await response.atext()
                         try:
@@ -0,0 +1,43 @@
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import JSONResponse
+from typing import Optional
+from datetime import datetime
+import logging
+import asyncio
+
+from app.services.usage_ledger import usage_ledger
+
+# 配置日志
+logger = logging.getLogger("usage_routes")
+logger.setLevel(logging.INFO)
+
+router = APIRouter()
+
+@router.get("/usage/summary")
+async def get_usage_summary(
+    window: int = Query(3600, ge=60, le=86400, description="时间窗口长度（秒）"),
+    since: Optional[datetime] = Query(None, description="开始时间，默认为结束时间前24小时"),
+    until: Optional[datetime] = Query(None, description="结束时间，默认为当前时间"),
+    session_id: Optional[str] = Query(None, description="只统计指定会话"),
+    top_sessions: int = Query(20, ge=1, le=200, description="返回token用量最多的会话数量")
+):
+    """
+    汇总上游调用用量，按模型、会话和时间窗口分组
+    """
+    try:
+        summary = await asyncio.to_thread(
+            usage_ledger.summarize,
+            window,
+            since.timestamp() if since else None,
+            until.timestamp() if until else None,
+            session_id,
+            top_sessions
+        )
+        return JSONResponse({**summary, "status": "success"})
+
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    except Exception as e:
+        logger.error(f"❌ 用量汇总错误: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"汇总用量时发生错误: {str(e)}")
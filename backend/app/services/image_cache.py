@@ -0,0 +1,124 @@
+import base64
+import hashlib
+import io
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from PIL import Image
+
+# 配置日志
+logger = logging.getLogger("image_cache")
+logger.setLevel(logging.INFO)
+
+# 可以原样发送给上游的图片格式
+_PASSTHROUGH_FORMATS = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp"}
+
+
+class ImageCache:
+    """
+    预上传截图的内存缓存，按条数和总大小限制并带过期时间
+    """
+
+    def __init__(self, max_entries: int = 256, max_bytes: int = 64 * 1024 * 1024,
+                 ttl: int = 600, max_side: int = 2048):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.max_side = max_side
+        self.entries: "OrderedDict[str, dict]" = OrderedDict()
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+
+    def put(self, content: bytes) -> dict:
+        """
+        预处理图片并缓存，返回包含图片句柄的条目（相同图片复用同一句柄）；
+        预处理后仍超过缓存容量的图片抛出ValueError
+        """
+        handle = hashlib.sha256(content).hexdigest()
+        with self.lock:
+            entry = self._get_locked(handle)
+            if entry is not None:
+                # 重新上传时刷新过期时间
+                entry["expires_at"] = time.time() + self.ttl
+                return entry
+
+        data, content_type, width, height = self.preprocess(content)
+        entry = {
+            "handle": handle,
+            "content_type": content_type,
+            "size": len(data),
+            "width": width,
+            "height": height,
+            # 提前完成base64编码，提交问题时直接使用
+            "data_url": f"data:{content_type};base64,{base64.b64encode(data).decode('utf-8')}",
+            "expires_at": time.time() + self.ttl,
+        }
+        cost = len(entry["data_url"])
+        if cost > self.max_bytes:
+            raise ValueError("图片过大，请缩小截图区域后重试")
+        with self.lock:
+            if handle not in self.entries:
+                # 先为新截图腾出空间，保证刚返回的句柄可用
+                self._evict_locked(cost)
+                self.entries[handle] = entry
+                self.total_bytes += cost
+        logger.info(f"🖼️ 截图已缓存: {handle[:12]} ({width}x{height}, {len(data)} bytes)")
+        return entry
+
+    def get(self, handle: str) -> Optional[dict]:
+        with self.lock:
+            return self._get_locked(handle)
+
+    def preprocess(self, content: bytes):
+        """
+        校验图片并把过大的截图缩小，返回 (数据, MIME类型, 宽, 高)
+        """
+        try:
+            image = Image.open(io.BytesIO(content))
+            image.load()
+        except Exception as e:
+            logger.warning(f"⚠️ 图片解析失败: {str(e)}")
+            raise ValueError("无法识别的图片格式")
+
+        if max(image.size) <= self.max_side and image.format in _PASSTHROUGH_FORMATS:
+            return content, _PASSTHROUGH_FORMATS[image.format], image.width, image.height
+
+        image.thumbnail((self.max_side, self.max_side))
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        buffer = io.BytesIO()
+        image.save(buffer, format="JPEG", quality=90)
+        return buffer.getvalue(), "image/jpeg", image.width, image.height
+
+    def _get_locked(self, handle: str) -> Optional[dict]:
+        entry = self.entries.get(handle)
+        if entry is None:
+            return None
+        if entry["expires_at"] <= time.time():
+            self._remove_locked(handle)
+            return None
+        self.entries.move_to_end(handle)
+        return entry
+
+    def _remove_locked(self, handle: str):
+        entry = self.entries.pop(handle)
+        self.total_bytes -= len(entry["data_url"])
+
+    def _evict_locked(self, incoming: int):
+        now = time.time()
+        for handle in [h for h, e in self.entries.items() if e["expires_at"] <= now]:
+            self._remove_locked(handle)
+        # 放入新截图会超出限制时淘汰最久未使用的截图
+        while self.entries and (len(self.entries) >= self.max_entries or self.total_bytes + incoming > self.max_bytes):
+            self._remove_locked(next(iter(self.entries)))
+
+
+image_cache = ImageCache(
+    max_entries=int(os.getenv("IMAGE_CACHE_ENTRIES", "256")),
+    max_bytes=int(os.getenv("IMAGE_CACHE_BYTES", str(64 * 1024 * 1024))),
+    ttl=int(os.getenv("IMAGE_CACHE_TTL", "600"))
+)
@@ -0,0 +1,157 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Optional, Tuple
+
+# 配置日志
+logger = logging.getLogger("job_queue")
+logger.setLevel(logging.INFO)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 0,
+    dedup_key TEXT NOT NULL,
+    message TEXT NOT NULL,
+    session_id TEXT,
+    image BLOB,
+    content_type TEXT,
+    result TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    ttl INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    expires_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_pending ON jobs (status, priority DESC, created_at);
+CREATE INDEX IF NOT EXISTS idx_jobs_dedup ON jobs (dedup_key);
+"""
+
+# 返回给客户端的字段（不包含图片内容）
+_PUBLIC_FIELDS = "id, status, priority, message, session_id, result, error, attempts, created_at, started_at, finished_at, expires_at"
+
+
+class JobQueue:
+    """
+    基于SQLite的持久化任务队列，支持优先级、去重和结果过期
+
+    只支持单个进程使用：重启恢复会把所有running任务放回队列，
+    多个uvicorn worker共用同一个数据库时会重复处理正在运行的任务
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        with self.lock, self.conn:
+            self.conn.executescript(_SCHEMA)
+
+    def requeue_running(self) -> int:
+        """
+        把上次运行中断的任务放回队列，只应在工作池启动时调用
+        """
+        with self.lock, self.conn:
+            recovered = self.conn.execute(
+                "UPDATE jobs SET status = 'pending', started_at = NULL WHERE status = 'running'"
+            ).rowcount
+        if recovered:
+            logger.info(f"🔄 恢复了 {recovered} 个中断的任务")
+        return recovered
+
+    @staticmethod
+    def dedup_key(message: str, image: Optional[bytes], session_id: Optional[str] = None) -> str:
+        # 去重限定在同一会话内，不同用户不会拿到彼此的任务
+        digest = hashlib.sha256((session_id or "").encode("utf-8") + b"\0" + message.encode("utf-8"))
+        if image:
+            digest.update(image)
+        return digest.hexdigest()
+
+    def submit(self, message: str, image: Optional[bytes] = None, content_type: Optional[str] = None,
+               session_id: Optional[str] = None, priority: int = 0, ttl: int = 3600) -> Tuple[dict, bool]:
+        """
+        提交任务，同一会话中相同问题和截图的未过期任务直接复用；
+        复用仍在排队的任务时，如果新提交的优先级更高则提升其优先级
+        """
+        key = self.dedup_key(message, image, session_id)
+        now = time.time()
+        with self.lock, self.conn:
+            existing = self.conn.execute(
+                f"SELECT {_PUBLIC_FIELDS} FROM jobs WHERE dedup_key = ? AND status != 'failed' "
+                "AND (expires_at IS NULL OR expires_at > ?) ORDER BY created_at DESC LIMIT 1",
+                (key, now)
+            ).fetchone()
+            if existing:
+                job = dict(existing)
+                if job["status"] == "pending" and priority > job["priority"]:
+                    self.conn.execute("UPDATE jobs SET priority = ? WHERE id = ?", (priority, job["id"]))
+                    job["priority"] = priority
+                return job, True
+
+            job_id = uuid.uuid4().hex
+            self.conn.execute(
+                "INSERT INTO jobs (id, status, priority, dedup_key, message, session_id, image, content_type, ttl, created_at) "
+                "VALUES (?, 'pending', ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, priority, key, message, session_id, image, content_type, ttl, now)
+            )
+            job = self.conn.execute(f"SELECT {_PUBLIC_FIELDS} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(job), False
+
+    def claim(self) -> Optional[dict]:
+        """
+        取出优先级最高、最早提交的待处理任务
+        """
+        with self.lock, self.conn:
+            # 单条UPDATE完成选取和标记，避免同一任务被重复领取
+            row = self.conn.execute(
+                "UPDATE jobs SET status = 'running', started_at = ? WHERE id = ("
+                "SELECT id FROM jobs WHERE status = 'pending' ORDER BY priority DESC, created_at LIMIT 1"
+                ") AND status = 'pending' RETURNING *",
+                (time.time(),)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def complete(self, job_id: str, result: str, attempts: int = 1):
+        self._finish(job_id, "done", result=result, attempts=attempts)
+
+    def fail(self, job_id: str, error: str):
+        self._finish(job_id, "failed", error=error)
+
+    def _finish(self, job_id: str, status: str, result: Optional[str] = None, error: Optional[str] = None,
+                attempts: int = 0):
+        now = time.time()
+        with self.lock, self.conn:
+            # 完成后释放图片数据，只保留结果到过期时间
+            self.conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, attempts = ?, image = NULL, "
+                "finished_at = ?, expires_at = ? + ttl WHERE id = ?",
+                (status, result, error, attempts, now, now, job_id)
+            )
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self.lock:
+            row = self.conn.execute(
+                f"SELECT {_PUBLIC_FIELDS} FROM jobs WHERE id = ? AND (expires_at IS NULL OR expires_at > ?)",
+                (job_id, time.time())
+            ).fetchone()
+        return dict(row) if row else None
+
+    def purge_expired(self) -> int:
+        with self.lock, self.conn:
+            return self.conn.execute(
+                "DELETE FROM jobs WHERE expires_at IS NOT NULL AND expires_at <= ?", (time.time(),)
+            ).rowcount
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
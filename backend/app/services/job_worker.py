@@ -0,0 +1,226 @@
+import asyncio
+import base64
+import json
+import logging
+import os
+import time
+from typing import Dict, List, Tuple
+
+import httpx
+
+from app.services.job_queue import JobQueue
+from app.services.usage_ledger import usage_ledger
+
+# 配置日志
+logger = logging.getLogger("job_worker")
+logger.setLevel(logging.INFO)
+
+API_URL = os.getenv("UPSTREAM_API_URL", "https://qfgapi.com/v1/chat/completions")
+MODEL = os.getenv("UPSTREAM_MODEL", "gemini-2.5-pro-thinking")
+
+
+def api_headers() -> dict:
+    """
+    上游API请求头，密钥从环境变量UPSTREAM_API_KEY读取
+    """
+    api_key = os.getenv("UPSTREAM_API_KEY")
+    if not api_key:
+        raise UpstreamError("未配置UPSTREAM_API_KEY", retryable=False)
+    return {
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": "application/json"
+    }
+
+
+class UpstreamError(Exception):
+    """
+    上游API调用失败，retryable表示是否值得重试
+    """
+
+    def __init__(self, message: str, retryable: bool = True):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class JobWorkerPool:
+    """
+    从持久化队列中取任务并调用上游模型的工作池
+    """
+
+    def __init__(self, queue: JobQueue, concurrency: int = 2, poll_interval: float = 1.0,
+                 max_retries: int = 2, retry_delay: float = 3.0, timeout: float = 120.0,
+                 purge_interval: float = 60.0):
+        self.queue = queue
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.timeout = timeout
+        self.purge_interval = purge_interval
+        # 运行中任务的尝试次数和已生成内容，供SSE订阅者增量读取
+        self.progress: Dict[str, dict] = {}
+        self._wakeup = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+
+    def notify(self):
+        """
+        有新任务提交时唤醒空闲的worker
+        """
+        self._wakeup.set()
+
+    async def start(self):
+        if self._tasks:
+            return
+        # 在当前事件循环中创建唤醒事件
+        self._wakeup = asyncio.Event()
+        await asyncio.to_thread(self.queue.requeue_running)
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.concurrency)]
+        self._tasks.append(asyncio.create_task(self._purge_loop()))
+        logger.info(f"👷 任务工作池已启动，并发数: {self.concurrency}")
+
+    async def stop(self):
+        # 未完成的任务保持running状态，下次启动工作池时会重新入队
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _worker(self, index: int):
+        while True:
+            self._wakeup.clear()
+            try:
+                job = await asyncio.to_thread(self.queue.claim)
+            except Exception as e:
+                logger.error(f"❌ worker {index} 取任务失败: {str(e)}")
+                job = None
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            try:
+                await self._process(job, index)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # 保持worker存活，任务留在running状态，下次启动时会重新入队
+                logger.error(f"❌ worker {index} 处理任务 {job['id']} 时出错: {str(e)}")
+
+    async def _purge_loop(self):
+        while True:
+            await asyncio.sleep(self.purge_interval)
+            try:
+                purged = await asyncio.to_thread(self.queue.purge_expired)
+                if purged:
+                    logger.info(f"🧹 清理了 {purged} 个过期任务")
+            except Exception as e:
+                logger.error(f"❌ 清理过期任务失败: {str(e)}")
+
+    async def _process(self, job: dict, index: int):
+        job_id = job["id"]
+        logger.info(f"🎯 worker {index} 开始处理任务 {job_id} (优先级 {job['priority']})")
+        try:
+            reply, attempt = await self._run_with_retries(job)
+            await asyncio.to_thread(self.queue.complete, job_id, reply, attempt)
+            logger.info(f"✅ 任务 {job_id} 完成")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"❌ 任务 {job_id} 失败: {str(e)}")
+            await asyncio.to_thread(self.queue.fail, job_id, str(e))
+        finally:
+            self.progress.pop(job_id, None)
+
+    async def _run_with_retries(self, job: dict) -> Tuple[str, int]:
+        """
+        带重试地调用上游，返回 (回复, 成功时的尝试序号)
+        """
+        last_error = None
+        for attempt in range(1, self.max_retries + 2):
+            if attempt > 1:
+                logger.info(f"🔄 任务 {job['id']} 第 {attempt} 次尝试 (共 {self.max_retries + 1} 次)")
+                await asyncio.sleep(self.retry_delay)
+            self.progress[job["id"]] = {"attempt": attempt, "text": ""}
+            try:
+                return await self._call_upstream(job), attempt
+            except UpstreamError as e:
+                last_error = e
+                if not e.retryable:
+                    break
+        raise last_error
+
+    async def _call_upstream(self, job: dict) -> str:
+        """
+        流式调用上游模型，边接收边更新任务进度
+        """
+        image = job.get("image")
+        if image:
+            image_base64 = base64.b64encode(image).decode('utf-8')
+            image_url = f"data:image/{(job.get('content_type') or 'image/png').split('/')[-1]};base64,{image_base64}"
+            content = [
+                {"type": "text", "text": job["message"]},
+                {"type": "image_url", "image_url": {"url": image_url}}
+            ]
+        else:
+            image_url = ""
+            content = job["message"]
+
+        payload = {
+            "model": MODEL,
+            "stream": True,
+            "stream_options": {"include_usage": True},
+            "messages": [{"role": "user", "content": content}]
+        }
+
+        headers = api_headers()
+        full_response = ""
+        started_at = time.perf_counter()
+        first_token_at = None
+        status_code = None
+        usage = None
+        try:
+            async with httpx.AsyncClient() as client:
+                async with client.stream('POST', API_URL, json=payload, headers=headers, timeout=self.timeout) as response:
+                    status_code = response.status_code
+                    if response.status_code != 200:
+                        error_text = (await response.aread()).decode('utf-8', errors='replace')
+                        raise UpstreamError(
+                            f"API错误 {response.status_code}: {error_text}",
+                            retryable=response.status_code not in (400, 401, 403)
+                        )
+                    async for line in response.aiter_lines():
+                        if not line.startswith('data: '):
+                            continue
+                        chunk_data = line[6:]
+                        if chunk_data.strip() == '[DONE]':
+                            break
+                        try:
+                            chunk_json = json.loads(chunk_data)
+                        except json.JSONDecodeError:
+                            continue
+                        if chunk_json.get('usage'):
+                            usage = chunk_json['usage']
+                        if chunk_json.get('choices'):
+                            delta = chunk_json['choices'][0].get('delta', {})
+                            if delta.get('content'):
+                                if first_token_at is None:
+                                    first_token_at = time.perf_counter()
+                                full_response += delta['content']
+                                self.progress[job["id"]]["text"] = full_response
+        except httpx.TimeoutException:
+            raise UpstreamError("请求超时")
+        except httpx.HTTPError as e:
+            raise UpstreamError(f"网络异常: {str(e)}")
+        finally:
+            usage_ledger.record(MODEL, "jobs", status_code, started_at, first_token_at,
+                                usage=usage, image_bytes=len(image_url),
+                                session_id=job.get("session_id"))
+
+        if not full_response.strip():
+            raise UpstreamError("上游返回了空回复")
+        return full_response
+
+
+job_queue = JobQueue(os.getenv("JOB_DB_PATH", "jobs/jobs.db"))
+job_workers = JobWorkerPool(job_queue, concurrency=int(os.getenv("JOB_WORKERS", "2")))
@@ -0,0 +1,264 @@
+import asyncio
+import json
+import logging
+import math
+import os
+import time
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional
+
+# 配置日志
+logger = logging.getLogger("usage_ledger")
+logger.setLevel(logging.INFO)
+
+# 百分位统计使用的对数分桶增长率（误差约 ±5%）
+_BUCKET_GROWTH = 1.1
+_LOG_GROWTH = math.log(_BUCKET_GROWTH)
+
+# 汇总默认统计最近24小时，时间窗口数量有上限，避免结果随账本历史无限增长
+DEFAULT_SUMMARY_RANGE = 24 * 3600
+MAX_SUMMARY_WINDOWS = 1440
+
+
+class StreamingHistogram:
+    """
+    对数分桶直方图，常数内存下估算百分位
+    """
+
+    def __init__(self):
+        self.buckets: Dict[int, int] = {}
+        self.count = 0
+
+    def add(self, value: Optional[float]):
+        if value is None or value < 0:
+            return
+        index = 0 if value < 1 else int(math.log(value) / _LOG_GROWTH) + 1
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+
+    def percentile(self, p: float) -> Optional[float]:
+        if self.count == 0:
+            return None
+        rank = max(1, math.ceil(self.count * p / 100))
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                # 返回桶的几何中点，相对误差不超过 ±5%
+                return round(_BUCKET_GROWTH ** (index - 0.5), 1) if index > 0 else 0.5
+        return None
+
+
+class UsageRollup:
+    """
+    单个分组（模型/会话/时间窗口）的累计统计
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.reasoning_tokens = 0
+        self.total_tokens = 0
+        self.image_bytes = 0
+        self.ttft_ms = StreamingHistogram()
+        self.duration_ms = StreamingHistogram()
+
+    def add(self, record: dict):
+        self.requests += 1
+        if record.get("status_code") != 200:
+            self.errors += 1
+        self.prompt_tokens += record.get("prompt_tokens") or 0
+        self.completion_tokens += record.get("completion_tokens") or 0
+        self.reasoning_tokens += record.get("reasoning_tokens") or 0
+        self.total_tokens += record.get("total_tokens") or 0
+        self.image_bytes += record.get("image_bytes") or 0
+        self.ttft_ms.add(record.get("ttft_ms"))
+        self.duration_ms.add(record.get("duration_ms"))
+
+    def to_dict(self) -> dict:
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "reasoning_tokens": self.reasoning_tokens,
+            "total_tokens": self.total_tokens,
+            "image_bytes": self.image_bytes,
+            "ttft_ms": {f"p{p}": self.ttft_ms.percentile(p) for p in (50, 90, 99)},
+            "duration_ms": {f"p{p}": self.duration_ms.percentile(p) for p in (50, 90, 99)},
+        }
+
+
+def extract_usage(usage: Optional[dict]) -> dict:
+    """
+    从上游返回的usage字段中提取token统计
+    """
+    usage = usage or {}
+    details = usage.get("completion_tokens_details") or {}
+    return {
+        "prompt_tokens": usage.get("prompt_tokens"),
+        "completion_tokens": usage.get("completion_tokens"),
+        "reasoning_tokens": details.get("reasoning_tokens", usage.get("reasoning_tokens")),
+        "total_tokens": usage.get("total_tokens"),
+    }
+
+
+class UsageLedger:
+    """
+    追加写入的上游调用账本，记录在后台批量落盘
+    """
+
+    def __init__(self, path: str, batch_size: int = 50, flush_interval: float = 2.0, max_pending: int = 10000):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_pending)
+        self._task: Optional[asyncio.Task] = None
+
+    def record(self, model: str, endpoint: str, status_code: Optional[int], started_at: float,
+               first_token_at: Optional[float] = None, usage: Optional[dict] = None,
+               image_bytes: int = 0, session_id: Optional[str] = None):
+        """
+        记录一次上游调用（不阻塞请求路径）
+        """
+        finished_at = time.perf_counter()
+        entry = {
+            "ts": time.time(),
+            "timestamp": datetime.now().isoformat(),
+            "model": model,
+            "endpoint": endpoint,
+            "session_id": session_id,
+            "status_code": status_code,
+            "image_bytes": image_bytes,
+            "ttft_ms": round((first_token_at - started_at) * 1000, 1) if first_token_at else None,
+            "duration_ms": round((finished_at - started_at) * 1000, 1),
+        }
+        entry.update(extract_usage(usage))
+        try:
+            self.queue.put_nowait(entry)
+        except asyncio.QueueFull:
+            logger.warning("⚠️ 用量账本队列已满，丢弃一条记录")
+
+    async def start(self):
+        if self._task is None:
+            # 在当前事件循环中重建队列，保留启动前已记录的条目
+            queue = asyncio.Queue(maxsize=self.max_pending)
+            while not self.queue.empty():
+                queue.put_nowait(self.queue.get_nowait())
+            self.queue = queue
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"📒 用量账本已启动: {self.path}")
+
+    async def stop(self):
+        if self._task is not None:
+            # 通知后台任务写完剩余记录后退出
+            await self.queue.put(None)
+            await self._task
+            self._task = None
+
+    async def _run(self):
+        stopping = False
+        while not stopping:
+            entry = await self.queue.get()
+            if entry is None:
+                break
+            batch = [entry]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    entry = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if entry is None:
+                    stopping = True
+                    break
+                batch.append(entry)
+            try:
+                await asyncio.to_thread(self._write_batch, batch)
+            except Exception as e:
+                logger.error(f"❌ 用量账本写入失败: {str(e)}")
+
+    def _write_batch(self, batch: List[dict]):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write("".join(json.dumps(entry, ensure_ascii=False) + "\n" for entry in batch))
+
+    def iter_records(self, since: Optional[float] = None, until: Optional[float] = None,
+                     session_id: Optional[str] = None) -> Iterator[dict]:
+        """
+        逐行读取账本，避免一次性加载到内存
+        """
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                ts = entry.get("ts", 0)
+                if since is not None and ts < since:
+                    continue
+                if until is not None and ts >= until:
+                    continue
+                if session_id is not None and entry.get("session_id") != session_id:
+                    continue
+                yield entry
+
+    def summarize(self, window: int = 3600, since: Optional[float] = None, until: Optional[float] = None,
+                  session_id: Optional[str] = None, top_sessions: int = 20) -> dict:
+        """
+        按模型、会话和时间窗口汇总用量，默认统计最近24小时；
+        by_session只返回token用量最多的top_sessions个会话
+        """
+        until = until if until is not None else time.time()
+        since = since if since is not None else until - DEFAULT_SUMMARY_RANGE
+        if (until - since) / window > MAX_SUMMARY_WINDOWS:
+            raise ValueError(f"时间窗口数量超过上限 {MAX_SUMMARY_WINDOWS}，请缩小时间范围或增大窗口")
+
+        total = UsageRollup()
+        by_model: Dict[str, UsageRollup] = {}
+        by_window: Dict[int, UsageRollup] = {}
+        # 第一遍只累计每个会话的token数，第二遍再为用量最多的会话计算完整统计
+        session_tokens: Dict[str, int] = {}
+
+        for entry in self.iter_records(since, until, session_id):
+            total.add(entry)
+            by_model.setdefault(entry.get("model") or "unknown", UsageRollup()).add(entry)
+            session_key = entry.get("session_id") or "anonymous"
+            session_tokens[session_key] = session_tokens.get(session_key, 0) + (entry.get("total_tokens") or 0)
+            window_start = int(entry.get("ts", 0) // window * window)
+            by_window.setdefault(window_start, UsageRollup()).add(entry)
+
+        top = sorted(session_tokens, key=session_tokens.get, reverse=True)[:top_sessions]
+        by_session: Dict[str, UsageRollup] = {key: UsageRollup() for key in top}
+        if by_session:
+            for entry in self.iter_records(since, until, session_id):
+                rollup = by_session.get(entry.get("session_id") or "anonymous")
+                if rollup is not None:
+                    rollup.add(entry)
+
+        return {
+            "window": window,
+            "since": datetime.fromtimestamp(since).isoformat(),
+            "until": datetime.fromtimestamp(until).isoformat(),
+            "total": total.to_dict(),
+            "by_model": {key: rollup.to_dict() for key, rollup in by_model.items()},
+            "sessions": len(session_tokens),
+            "by_session": {key: rollup.to_dict() for key, rollup in by_session.items()},
+            "by_window": [
+                {"start": datetime.fromtimestamp(start).isoformat(), **by_window[start].to_dict()}
+                for start in sorted(by_window)
+            ],
+        }
+
+
+usage_ledger = UsageLedger(os.getenv("USAGE_LEDGER_PATH", "usage/ledger.jsonl"))
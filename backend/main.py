@@ -1,7 +1,15 @@
+import os
+from dotenv import load_dotenv
+
+# 在导入各模块前加载backend/.env中的配置
+load_dotenv(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".env"))
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from app.routes import pdf_routes
+from app.routes import pdf_routes, usage_routes, job_routes
 from app.middleware import DebugMiddleware
+from app.services.usage_ledger import usage_ledger
+from app.services.job_worker import job_workers
 
 app = FastAPI(
     title="PDF搜索系统API",
@@ -10,7 +18,6 @@ app = FastAPI(
 )
 
 # 添加调试中间件（在开发环境中）
-import os
 if os.getenv("DEBUG", "true").lower() == "true":
     app.add_middleware(DebugMiddleware)
     print("🔍 调试中间件已启用 - 将记录所有API请求和响应")
@@ -26,6 +33,19 @@ app.add_middleware(
 
 # 包含路由
 app.include_router(pdf_routes.router, prefix="/api", tags=["PDF"])
+app.include_router(usage_routes.router, prefix="/api", tags=["Usage"])
+app.include_router(job_routes.router, prefix="/api", tags=["Jobs"])
+
+@app.on_event("startup")
+async def startup():
+    await usage_ledger.start()
+    await job_workers.start()
+
+@app.on_event("shutdown")
+async def shutdown():
+    await job_workers.stop()
+    # 写入尚未落盘的用量记录
+    await usage_ledger.stop()
 
 @app.get("/")
 async def root():
@@ -0,0 +1,71 @@
+import functools
+import io
+import json
+import os
+import sys
+import tempfile
+
+import httpx
+import pytest
+from PIL import Image
+
+# 测试使用临时目录，避免写入开发环境的数据文件
+_DATA_DIR = tempfile.mkdtemp(prefix="pdf_search_tests_")
+os.environ.setdefault("JOB_DB_PATH", os.path.join(_DATA_DIR, "jobs.db"))
+os.environ.setdefault("USAGE_LEDGER_PATH", os.path.join(_DATA_DIR, "ledger.jsonl"))
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def sse_body(*contents):
+    """
+    构造上游流式响应，最后一个chunk携带用量
+    """
+    body = "".join("data: " + json.dumps({"choices": [{"delta": {"content": c}}]}) + "\n\n" for c in contents)
+    body += "data: " + json.dumps({"choices": [], "usage": {"prompt_tokens": 3, "completion_tokens": 2}}) + "\n\n"
+    return body + "data: [DONE]\n\n"
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    """
+    用MockTransport替换上游API，responses按调用顺序返回
+    """
+    from app.services.job_worker import job_workers
+
+    calls = []
+    responses = []
+
+    def handler(request):
+        calls.append(json.loads(request.content))
+        if responses:
+            return responses.pop(0)
+        return httpx.Response(200, text=sse_body("Hel", "lo"))
+
+    monkeypatch.setattr(httpx, "AsyncClient", functools.partial(httpx.AsyncClient, transport=httpx.MockTransport(handler)))
+    monkeypatch.setattr(job_workers, "retry_delay", 0)
+    monkeypatch.setenv("UPSTREAM_API_KEY", "test-key")
+    return calls, responses
+
+
+@pytest.fixture
+def client(upstream):
+    from fastapi.testclient import TestClient
+
+    import main
+
+    with TestClient(main.app) as test_client:
+        yield test_client
+
+
+@pytest.fixture
+def make_png():
+    """
+    生成指定颜色和尺寸的PNG图片字节
+    """
+    def make(color="red", size=(8, 8)):
+        buffer = io.BytesIO()
+        Image.new("RGB", size, color).save(buffer, format="PNG")
+        return buffer.getvalue()
+
+    return make
@@ -0,0 +1,37 @@
+def test_chat_stream_uses_preuploaded_image(client, upstream, make_png):
+    calls, _ = upstream
+    uploaded = client.post("/api/images", files={"screenshot": ("a.png", make_png(), "image/png")})
+    assert uploaded.status_code == 200
+    handle = uploaded.json()["image_handle"]
+
+    response = client.post("/api/chat/stream", data={"message": "hi", "image_handle": handle})
+    assert response.status_code == 200
+    assert '"content": "Hel"' in response.text
+    image_part = calls[-1]["messages"][0]["content"][1]
+    assert image_part["image_url"]["url"].startswith("data:image/png;base64,")
+    assert calls[-1]["stream_options"] == {"include_usage": True}
+
+
+def test_unknown_image_handle_returns_404(client):
+    for path in ("/api/chat", "/api/chat/stream"):
+        response = client.post(path, data={"message": "hi", "image_handle": "missing"})
+        assert response.status_code == 404
+
+
+def test_preupload_rejects_invalid_image(client):
+    response = client.post("/api/images", files={"screenshot": ("a.png", b"junk", "image/png")})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "无法识别的图片格式"
+
+
+def test_usage_records_image_bytes_sent_upstream(client, upstream, make_png, monkeypatch):
+    from app.services.usage_ledger import usage_ledger
+
+    calls, _ = upstream
+    recorded = []
+    monkeypatch.setattr(usage_ledger, "record", lambda *args, **kwargs: recorded.append(kwargs))
+    handle = client.post("/api/images", files={"screenshot": ("a.png", make_png(), "image/png")}).json()["image_handle"]
+
+    client.post("/api/chat/stream", data={"message": "hi", "image_handle": handle})
+    data_url = calls[-1]["messages"][0]["content"][1]["image_url"]["url"]
+    assert recorded[-1]["image_bytes"] == len(data_url)
@@ -0,0 +1,63 @@
+import pytest
+
+from app.services.image_cache import ImageCache
+
+
+def test_put_returns_resolvable_handle(make_png):
+    cache = ImageCache()
+    entry = cache.put(make_png("red"))
+
+    assert cache.get(entry["handle"]) is entry
+    assert entry["data_url"].startswith("data:image/png;base64,")
+    assert cache.put(make_png("red"))["handle"] == entry["handle"]
+
+
+def test_evicts_least_recently_used_by_entry_count(make_png):
+    cache = ImageCache(max_entries=2)
+    first = cache.put(make_png("red"))
+    second = cache.put(make_png("green"))
+    cache.get(first["handle"])
+    third = cache.put(make_png("blue"))
+
+    assert cache.get(second["handle"]) is None
+    assert cache.get(first["handle"]) is not None
+    assert cache.get(third["handle"]) is not None
+
+
+def test_evicts_older_entries_by_bytes_and_keeps_new_one(make_png):
+    first_png = make_png("red")
+    cost = len(ImageCache().put(first_png)["data_url"])
+    cache = ImageCache(max_bytes=cost + 10)
+    first = cache.put(first_png)
+    second = cache.put(make_png("green"))
+
+    assert cache.get(first["handle"]) is None
+    assert cache.get(second["handle"]) is not None
+    assert cache.total_bytes <= cache.max_bytes
+
+
+def test_rejects_image_larger_than_cache(make_png):
+    cache = ImageCache(max_bytes=10)
+    with pytest.raises(ValueError):
+        cache.put(make_png("red"))
+    assert cache.total_bytes == 0
+
+
+def test_downscales_large_images(make_png):
+    entry = ImageCache(max_side=64).put(make_png("red", size=(256, 128)))
+
+    assert (entry["width"], entry["height"]) == (64, 32)
+    assert entry["content_type"] == "image/jpeg"
+
+
+def test_expired_handle_is_not_returned(make_png):
+    cache = ImageCache(ttl=0)
+    entry = cache.put(make_png("red"))
+
+    assert cache.get(entry["handle"]) is None
+    assert cache.total_bytes == 0
+
+
+def test_rejects_non_image_with_plain_message():
+    with pytest.raises(ValueError, match="^无法识别的图片格式$"):
+        ImageCache().put(b"not an image")
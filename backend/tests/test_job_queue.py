@@ -0,0 +1,84 @@
+from app.services.job_queue import JobQueue
+
+
+def test_claim_orders_by_priority_then_submission(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.db"))
+    queue.submit("first")
+    queue.submit("urgent", priority=5)
+    queue.submit("second")
+
+    assert [queue.claim()["message"] for _ in range(3)] == ["urgent", "first", "second"]
+    assert queue.claim() is None
+
+
+def test_submit_deduplicates_same_message_and_image(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.db"))
+    job, deduplicated = queue.submit("question", image=b"png")
+    again, again_deduplicated = queue.submit("question", image=b"png")
+    other, other_deduplicated = queue.submit("question", image=b"jpg")
+
+    assert not deduplicated
+    assert again_deduplicated and again["id"] == job["id"]
+    assert not other_deduplicated and other["id"] != job["id"]
+
+
+def test_dedup_is_scoped_to_session(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.db"))
+    job, _ = queue.submit("question", session_id="alice")
+    again, again_deduplicated = queue.submit("question", session_id="alice")
+    other, other_deduplicated = queue.submit("question", session_id="bob")
+
+    assert again_deduplicated and again["id"] == job["id"]
+    assert not other_deduplicated and other["session_id"] == "bob"
+
+
+def test_dedup_raises_priority_of_pending_job(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.db"))
+    job, _ = queue.submit("question")
+    again, _ = queue.submit("question", priority=9)
+
+    assert again["priority"] == 9
+    assert queue.get(job["id"])["priority"] == 9
+
+
+def test_failed_job_is_not_reused(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.db"))
+    job, _ = queue.submit("question")
+    queue.claim()
+    queue.fail(job["id"], "boom")
+
+    retry, deduplicated = queue.submit("question")
+    assert not deduplicated and retry["id"] != job["id"]
+
+
+def test_get_returns_none_after_result_expires(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.db"))
+    job, _ = queue.submit("question", ttl=0)
+    queue.claim()
+    queue.complete(job["id"], "answer")
+
+    assert queue.get(job["id"]) is None
+    assert queue.purge_expired() == 1
+
+
+def test_claimed_job_is_not_claimed_again_from_another_connection(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    queue = JobQueue(path)
+    other = JobQueue(path)
+    job, _ = queue.submit("question")
+
+    assert queue.claim()["id"] == job["id"]
+    assert other.claim() is None
+
+
+def test_running_jobs_are_requeued_only_on_request(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    queue = JobQueue(path)
+    job, _ = queue.submit("question")
+    queue.claim()
+    queue.close()
+
+    reopened = JobQueue(path)
+    assert reopened.get(job["id"])["status"] == "running"
+    assert reopened.requeue_running() == 1
+    assert reopened.claim()["id"] == job["id"]
@@ -0,0 +1,99 @@
+import asyncio
+import json
+import time
+
+import httpx
+
+from app.routes import job_routes
+from app.services.job_worker import job_workers
+
+
+def test_job_parameters_are_validated(client):
+    assert client.post("/api/jobs", data={"message": "hi", "ttl": "-5"}).status_code == 422
+    assert client.post("/api/jobs", data={"message": "hi", "priority": "1000"}).status_code == 422
+
+
+def test_job_retries_and_completes(client, upstream):
+    _, responses = upstream
+    responses.append(httpx.Response(503, text="overloaded"))
+
+    submitted = client.post("/api/jobs", data={"message": f"retry {time.time()}"})
+    assert submitted.status_code == 202
+    job_id = submitted.json()["job_id"]
+
+    deadline = time.time() + 5
+    while time.time() < deadline:
+        job = client.get(f"/api/jobs/{job_id}").json()
+        if job["status"] == "done":
+            break
+        time.sleep(0.05)
+
+    assert job["status"] == "done"
+    assert job["result"] == "Hello"
+    assert job["attempts"] == 2
+    assert client.get("/api/jobs/missing").status_code == 404
+
+
+def collect_events(monkeypatch, states):
+    """
+    按给定的 (任务, 进度) 序列驱动SSE生成器，返回解析后的事件
+    """
+    states = list(states)
+
+    def fake_get(job_id):
+        job, progress = states.pop(0) if len(states) > 1 else states[0]
+        job_workers.progress.pop(job_id, None)
+        if progress:
+            job_workers.progress[job_id] = progress
+        return job
+
+    monkeypatch.setattr(job_routes.job_queue, "get", fake_get)
+
+    async def run():
+        return [chunk async for chunk in job_routes.job_event_stream("job", interval=0)]
+
+    try:
+        chunks = asyncio.run(run())
+    finally:
+        job_workers.progress.pop("job", None)
+    return [json.loads(chunk[len("data: "):]) for chunk in chunks]
+
+
+def test_event_stream_resets_when_attempt_changes(monkeypatch):
+    running = {"status": "running"}
+    events = collect_events(monkeypatch, [
+        (running, {"attempt": 1, "text": "abc"}),
+        (running, {"attempt": 2, "text": "wxyz"}),
+        ({"status": "done", "result": "wxyz!", "attempts": 2}, None),
+    ])
+
+    assert [e.get("type") for e in events] == ["status", "content", "reset", "content", "status", "content", "done"]
+    assert [e["content"] for e in events if e.get("type") == "content"] == ["abc", "wxyz", "!"]
+
+
+def test_event_stream_resends_result_from_unseen_attempt(monkeypatch):
+    events = collect_events(monkeypatch, [
+        ({"status": "running"}, {"attempt": 1, "text": "abc"}),
+        ({"status": "done", "result": "final", "attempts": 2}, None),
+    ])
+
+    assert [e.get("type") for e in events] == ["status", "content", "status", "reset", "content", "done"]
+    assert events[4]["content"] == "final"
+
+
+def test_job_fails_without_api_key(client, upstream, monkeypatch):
+    calls, _ = upstream
+    monkeypatch.delenv("UPSTREAM_API_KEY")
+
+    job_id = client.post("/api/jobs", data={"message": f"no key {time.time()}"}).json()["job_id"]
+
+    deadline = time.time() + 5
+    while time.time() < deadline:
+        job = client.get(f"/api/jobs/{job_id}").json()
+        if job["status"] == "failed":
+            break
+        time.sleep(0.05)
+
+    assert job["status"] == "failed"
+    assert "UPSTREAM_API_KEY" in job["error"]
+    assert calls == []
@@ -0,0 +1,79 @@
+import asyncio
+import time
+
+import pytest
+
+from app.services.usage_ledger import StreamingHistogram, UsageLedger
+
+
+def test_percentile_stays_within_bucket_error():
+    histogram = StreamingHistogram()
+    for _ in range(10):
+        histogram.add(100)
+
+    assert abs(histogram.percentile(50) - 100) / 100 <= 0.05
+    assert StreamingHistogram().percentile(50) is None
+
+
+def test_stop_flushes_pending_records(tmp_path):
+    ledger = UsageLedger(str(tmp_path / "ledger.jsonl"), batch_size=100, flush_interval=60)
+
+    async def run():
+        await ledger.start()
+        started_at = time.perf_counter()
+        for i in range(3):
+            ledger.record("model-a", "chat", 200, started_at, usage={
+                "prompt_tokens": 10,
+                "completion_tokens": 5,
+                "completion_tokens_details": {"reasoning_tokens": 2},
+                "total_tokens": 15
+            }, image_bytes=100, session_id="s1")
+        await ledger.stop()
+
+    asyncio.run(run())
+
+    records = list(ledger.iter_records())
+    assert len(records) == 3
+    assert records[0]["reasoning_tokens"] == 2
+
+
+def test_summarize_groups_by_model_session_and_window(tmp_path):
+    ledger = UsageLedger(str(tmp_path / "ledger.jsonl"))
+    now = time.time()
+    ledger._write_batch([
+        {"ts": now, "model": "a", "session_id": "s1", "status_code": 200, "prompt_tokens": 10, "duration_ms": 100},
+        {"ts": now, "model": "b", "session_id": None, "status_code": 503, "prompt_tokens": 5, "duration_ms": 200},
+    ])
+
+    summary = ledger.summarize(window=3600)
+    assert summary["total"]["requests"] == 2
+    assert summary["total"]["errors"] == 1
+    assert summary["by_model"]["a"]["prompt_tokens"] == 10
+    assert set(summary["by_session"]) == {"s1", "anonymous"}
+    assert len(summary["by_window"]) == 1
+    assert ledger.summarize(since=now + 1)["total"]["requests"] == 0
+
+
+def test_summarize_is_bounded_by_default_range_and_top_sessions(tmp_path):
+    ledger = UsageLedger(str(tmp_path / "ledger.jsonl"))
+    now = time.time()
+    ledger._write_batch(
+        [{"ts": now - 2 * 24 * 3600, "model": "old", "session_id": "old", "total_tokens": 1000}]
+        + [{"ts": now, "model": "a", "session_id": f"s{i}", "total_tokens": i} for i in range(5)]
+    )
+
+    summary = ledger.summarize(top_sessions=2)
+    assert "old" not in summary["by_model"]
+    assert summary["sessions"] == 5
+    assert list(summary["by_session"]) == ["s4", "s3"]
+
+    filtered = ledger.summarize(session_id="s1")
+    assert filtered["total"]["requests"] == 1
+    assert list(filtered["by_session"]) == ["s1"]
+
+
+def test_summarize_rejects_too_many_windows(tmp_path):
+    ledger = UsageLedger(str(tmp_path / "ledger.jsonl"))
+
+    with pytest.raises(ValueError):
+        ledger.summarize(window=60, since=0)
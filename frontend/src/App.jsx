@@ -6,7 +6,7 @@ import ModeSelector from './components/ModeSelector';
 import AreaSelector from './components/AreaSelector';
 import ChatPanel from './components/ChatPanel'; // 右侧聊天界面（支持流式）
 import { captureAreaScreenshot } from './utils/screenshot';
-import { submitQuestion } from './utils/api';
+import { submitQuestion, uploadScreenshot } from './utils/api';
 
 function App() {
   // 模式管理
@@ -52,6 +52,9 @@ function App() {
       const containerId = mode === 'video' ? 'video-viewer-container' : 'pdf-viewer-container';
       const screenshot = await captureAreaScreenshot(containerId, area);
 
+      // 截图完成后立即预上传，发送消息时只需携带图片句柄
+      screenshot.imageHandle = uploadScreenshot(screenshot.blob);
+
       // 设置截图
       setCurrentScreenshot(screenshot);
     } catch (error) {
@@ -1,6 +1,6 @@
 import React, { useState, useRef, useEffect, startTransition } from 'react';
 import { flushSync } from 'react-dom';
-import { sendChatMessage, getChatHistory } from '../utils/api';
+import { sendChatMessage, getChatHistory, getSessionId } from '../utils/api';
 import ReactMarkdown from 'react-markdown';
 
 const ChatV2 = ({ isExpanded: propExpanded, onToggle, screenshot, onClearScreenshot, mode = 'video', disabled = false }) => {
@@ -92,21 +92,37 @@ const ChatV2 = ({ isExpanded: propExpanded, onToggle, screenshot, onClearScreens
 
     try {
       // 创建FormData发送流式请求
-      const formData = new FormData();
-      formData.append('message', userMessage.content);
-      formData.append('timestamp', userMessage.timestamp.toISOString());
-      formData.append('mode', mode); // 添加模式信息
-
-      // 如果有截图，添加到表单数据
-      if (screenshot?.blob) {
-        formData.append('screenshot', screenshot.blob, 'screenshot.png');
-      }
+      const buildFormData = (imageHandle) => {
+        const formData = new FormData();
+        formData.append('message', userMessage.content);
+        formData.append('timestamp', userMessage.timestamp.toISOString());
+        formData.append('mode', mode); // 添加模式信息
+        formData.append('session_id', getSessionId());
+
+        // 如果有截图，优先使用预上传的图片句柄，否则随消息上传
+        if (imageHandle) {
+          formData.append('image_handle', imageHandle);
+        } else if (screenshot?.blob) {
+          formData.append('screenshot', screenshot.blob, 'screenshot.png');
+        }
+        return formData;
+      };
 
-      const response = await fetch('/api/chat/stream', {
+      const imageHandle = screenshot?.imageHandle ? await screenshot.imageHandle : null;
+      let response = await fetch('/api/chat/stream', {
         method: 'POST',
-        body: formData
+        body: buildFormData(imageHandle)
       });
 
+      // 图片句柄已过期或被淘汰时，改为随消息上传截图重试一次
+      if (response.status === 404 && imageHandle && screenshot?.blob) {
+        console.warn('截图句柄已失效，改为直接上传截图');
+        response = await fetch('/api/chat/stream', {
+          method: 'POST',
+          body: buildFormData(null)
+        });
+      }
+
       if (!response.ok) {
         throw new Error(`HTTP error! status: ${response.status}`);
       }
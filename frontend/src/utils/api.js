@@ -1,5 +1,10 @@
 const API_BASE_URL = import.meta.env.VITE_API_URL || 'http://localhost:8001/api';
 
+// 会话ID，页面加载时生成一次，用于后端按会话统计用量
+const SESSION_ID = `${Date.now()}-${Math.random().toString(36).slice(2, 10)}`;
+
+export const getSessionId = () => SESSION_ID;
+
 export const submitQuestion = async ({ question, screenshot }) => {
   const formData = new FormData();
   formData.append('question', question);
@@ -58,6 +63,30 @@ export const uploadPDF = async (file) => {
   }
 };
 
+// 选区完成后立即预上传截图，返回图片句柄供发送消息时引用
+export const uploadScreenshot = async (blob) => {
+  const formData = new FormData();
+  formData.append('screenshot', blob, 'screenshot.png');
+
+  try {
+    const response = await fetch(`${API_BASE_URL}/images`, {
+      method: 'POST',
+      body: formData,
+    });
+
+    if (!response.ok) {
+      throw new Error(`HTTP error! status: ${response.status}`);
+    }
+
+    const result = await response.json();
+    console.log('Screenshot pre-uploaded:', result.image_handle);
+    return result.image_handle;
+  } catch (error) {
+    console.error('截图预上传失败:', error);
+    return null;
+  }
+};
+
 export const sendChatMessage = async (message, screenshot = null) => {
   try {
     console.log('Sending chat message to:', `${API_BASE_URL}/chat`);
@@ -65,19 +94,36 @@ export const sendChatMessage = async (message, screenshot = null) => {
     console.log('Screenshot:', screenshot ? 'included' : 'none');
 
     // 统一使用FormData格式，兼容有无截图的情况
-    const formData = new FormData();
-    formData.append('message', message);
-    formData.append('timestamp', new Date().toISOString());
-
-    if (screenshot && screenshot.blob) {
-      formData.append('screenshot', screenshot.blob, 'screenshot.png');
-    }
-
-    const response = await fetch(`${API_BASE_URL}/chat`, {
+    const buildFormData = (imageHandle) => {
+      const formData = new FormData();
+      formData.append('message', message);
+      formData.append('timestamp', new Date().toISOString());
+      formData.append('session_id', SESSION_ID);
+
+      // 优先使用预上传的图片句柄，否则随消息上传截图
+      if (imageHandle) {
+        formData.append('image_handle', imageHandle);
+      } else if (screenshot && screenshot.blob) {
+        formData.append('screenshot', screenshot.blob, 'screenshot.png');
+      }
+      return formData;
+    };
+
+    const imageHandle = screenshot?.imageHandle ? await screenshot.imageHandle : null;
+    let response = await fetch(`${API_BASE_URL}/chat`, {
       method: 'POST',
-      body: formData,
+      body: buildFormData(imageHandle),
     });
 
+    // 图片句柄已过期或被淘汰时，改为随消息上传截图重试一次
+    if (response.status === 404 && imageHandle && screenshot?.blob) {
+      console.warn('截图句柄已失效，改为直接上传截图');
+      response = await fetch(`${API_BASE_URL}/chat`, {
+        method: 'POST',
+        body: buildFormData(null),
+      });
+    }
+
     console.log('Chat response status:', response.status);
     if (!response.ok) {
       const errorText = await response.text();